@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+#
+# Measure the cold start of urlpy2: the import and the first call of each
+# major API, each in a fresh interpreter.
+#
+#   python benchmarks/bench_coldstart.py [--runs N] [--save FILE]
+#                                        [--compare FILE] [--tolerance T]
+#
+
+'''Time `import urlpy2` and the first call of each major API in fresh
+interpreters, and report the median of several runs in milliseconds. A
+saved baseline can be compared against, failing when a step got slower
+than the tolerance allows.'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+URL = 'http://user@www.Example.com:80/a/./b/../c;p?utm_source=x&q=1#fragment'
+
+# Each step runs once, in this order, after the ones before it
+STEPS = [
+    ('import', 'import urlpy2'),
+    ('parse', 'url = urlpy2.parse(URL)'),
+    ('str', 'str(url)'),
+    ('canonical', 'url.canonical()'),
+    ('abspath', 'url.abspath()'),
+    ('escape', 'url.escape()'),
+    ('punycode', "urlpy2.parse('http://www.k\\xfcndigen.de/').punycode()"),
+    ('equiv', 'url.equiv(URL)'),
+    ('relative', "url.relative('../d?e=f')"),
+    ('pld', 'url.pld'),
+    ('tld', 'url.tld'),
+    ('remove_tracking', 'url.remove_tracking()'),
+]
+
+SCRIPT = '''
+import sys, time
+sys.path.insert(0, {root!r})
+URL = {url!r}
+timings = {{}}
+for name, code in {steps!r}:
+    start = time.perf_counter()
+    exec(code)
+    timings[name] = (time.perf_counter() - start) * 1000.0
+# Imported last so that urlpy2 pays for its own imports
+import json
+print(json.dumps(timings))
+'''
+
+
+def run_once():
+    '''Return the timings of one fresh interpreter, in milliseconds'''
+    script = SCRIPT.format(root=ROOT, url=URL, steps=STEPS)
+    output = subprocess.check_output([sys.executable, '-c', script])
+    return json.loads(output.decode('utf-8'))
+
+
+def median(values):
+    values = sorted(values)
+    middle = len(values) // 2
+    if len(values) % 2:
+        return values[middle]
+    return (values[middle - 1] + values[middle]) / 2.0
+
+
+def measure(runs):
+    '''Return the median timings of several runs, in milliseconds'''
+    samples = [run_once() for _ in range(runs)]
+    return dict(
+        (name, median([sample[name] for sample in samples]))
+        for name, _ in STEPS)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--runs', type=int, default=15,
+        help='the number of fresh interpreters to time')
+    parser.add_argument('--save', metavar='FILE',
+        help='save the timings as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+        help='compare the timings with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.25,
+        help='the slowdown over the baseline allowed for each step')
+    args = parser.parse_args(argv)
+
+    timings = measure(args.runs)
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as handle:
+            baseline = json.load(handle)
+
+    regressions = []
+    print('{:<18}{:>12}{:>12}'.format('step', 'ms', 'baseline'))
+    for name, _ in STEPS:
+        line = '{:<18}{:>12.2f}'.format(name, timings[name])
+        if name in baseline:
+            line += '{:>12.2f}'.format(baseline[name])
+            if timings[name] > baseline[name] * (1 + args.tolerance):
+                regressions.append(name)
+                line += '  slower'
+        print(line)
+    total = sum(timings.values())
+    print('{:<18}{:>12.2f}'.format('total', total))
+
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump(timings, handle, indent=2, sort_keys=True)
+
+    if regressions:
+        print('regressed: {}'.format(', '.join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,71 @@
+#!/usr/bin/env python
+#
+# Measure the memory used per URL instance.
+#
+#   python benchmarks/bench_memory.py [--count N]
+#
+
+'''Compare the bytes per instance of URL, which uses __slots__, with the
+same fields stored in an instance __dict__ as URL did before.'''
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import urlpy2
+
+
+class DictURL(object):
+    '''The previous layout of URL: its eight fields in an instance __dict__'''
+
+    def __init__(self, scheme, host, port, path, params, query, fragment, userinfo=None):
+        self.scheme = scheme
+        self.host = host
+        self.port = port
+        self.path = path
+        self.params = params
+        self.query = query
+        self.fragment = fragment
+        self.userinfo = userinfo
+
+
+def bytes_per_instance(cls, components, count):
+    '''Return the bytes allocated per instance of cls built from the same
+    components, so that only the instances themselves are measured.'''
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    instances = [cls(*components) for _ in range(count)]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    allocated = sum(stat.size_diff for stat in stats)
+    # The list holding the instances is not part of their cost
+    allocated -= sys.getsizeof(instances)
+    return allocated / float(count)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=100000,
+        help='the number of instances to allocate')
+    args = parser.parse_args(argv)
+
+    components = urlpy2.split_url(
+        'http://user@www.example.com:8080/a/b;p?q=1&r=2#fragment')
+    before = bytes_per_instance(DictURL, components, args.count)
+    after = bytes_per_instance(urlpy2.URL, components, args.count)
+
+    print('{:<24}{:>12}'.format('layout', 'bytes/URL'))
+    print('{:<24}{:>12.1f}'.format('__dict__ (before)', before))
+    print('{:<24}{:>12.1f}'.format('__slots__ (URL)', after))
+    print('saved {:.1f} bytes per URL ({:.0%})'.format(
+        before - after, (before - after) / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+#!/usr/bin/env python
+#
+# Time every URL operation on a generated corpus.
+#
+#   python benchmarks/bench_operations.py [--count N] [--seed S]
+#       [--repeat R] [--only OPERATION ...] [--save FILE]
+#       [--compare FILE] [--tolerance T]
+#
+
+'''Time each URL operation, and a chain of them end to end, on a seeded
+corpus of realistic urls. Reports operations per second, the best of
+several runs, and the peak bytes allocated per operation, which includes
+the results parse and end_to_end keep. A saved baseline can be compared
+against, failing when an operation got slower than the tolerance allows.'''
+
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(HERE))
+sys.path.insert(0, HERE)
+
+import urlpy2
+import corpus
+
+
+def _fresh(urls):
+    '''Copies of the parsed urls, since most operations modify them'''
+    return [url.copy() for url in urls]
+
+
+def _parse(strings, urls):
+    parse = urlpy2.URL.parse
+    return [parse(string) for string in strings]
+
+
+def _method(name, *args):
+    def operation(strings, urls):
+        for url in urls:
+            getattr(url, name)(*args)
+    return operation
+
+
+def _str(strings, urls):
+    for url in urls:
+        str(url)
+
+
+def _equiv(strings, urls):
+    for url, string in zip(urls, strings):
+        url.equiv(string)
+
+
+def _pld_tld(strings, urls):
+    for url in urls:
+        url.pld
+        url.tld
+
+
+def _end_to_end(strings, urls):
+    parse = urlpy2.URL.parse
+    return [
+        str(parse(string).remove_tracking().defrag().canonical().abspath()
+            .escape().punycode())
+        for string in strings]
+
+
+# The operations, and whether they work on fresh copies of parsed urls
+OPERATIONS = [
+    ('parse', _parse, False),
+    ('str', _str, True),
+    ('canonical', _method('canonical'), True),
+    ('abspath', _method('abspath'), True),
+    ('escape', _method('escape'), True),
+    ('punycode', _method('punycode'), True),
+    ('equiv', _equiv, True),
+    ('pld/tld', _pld_tld, True),
+    ('relative', _method('relative', '../other?x=1'), True),
+    ('remove_tracking', _method('remove_tracking'), True),
+    ('end_to_end', _end_to_end, False),
+]
+
+
+def run(operation, strings, urls, fresh):
+    '''Return the seconds taken by one run of the operation'''
+    if fresh:
+        urls = _fresh(urls)
+    start = time.perf_counter()
+    operation(strings, urls)
+    return time.perf_counter() - start
+
+
+def allocated(operation, strings, urls, fresh):
+    '''Return the peak bytes allocated by one run of the operation, per url'''
+    if fresh:
+        urls = _fresh(urls)
+    tracemalloc.start()
+    try:
+        operation(strings, urls)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak / float(len(strings))
+
+
+def measure(strings, repeat, only=None):
+    '''Return the ops/sec and bytes/op of each operation on the strings'''
+    urls = [urlpy2.URL.parse(string) for string in strings]
+    # Load the rules and the public suffix list outside of the timings
+    urlpy2.load_rules()
+    urlpy2.get_psl()
+
+    results = {}
+    for name, operation, fresh in OPERATIONS:
+        if only and name not in only:
+            continue
+        run(operation, strings[:100], urls[:100], fresh)
+        best = min(run(operation, strings, urls, fresh) for _ in range(repeat))
+        results[name] = {
+            'ops': len(strings) / best,
+            'bytes': allocated(operation, strings, urls, fresh),
+        }
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10000,
+        help='the number of urls in the corpus')
+    parser.add_argument('--seed', type=int, default=0,
+        help='the seed of the corpus')
+    parser.add_argument('--repeat', type=int, default=5,
+        help='the number of timed runs of each operation')
+    parser.add_argument('--only', nargs='+', metavar='OPERATION',
+        choices=[name for name, _, _ in OPERATIONS],
+        help='only time these operations')
+    parser.add_argument('--save', metavar='FILE',
+        help='save the results as a baseline')
+    parser.add_argument('--compare', metavar='FILE',
+        help='compare the results with a saved baseline')
+    parser.add_argument('--tolerance', type=float, default=0.1,
+        help='the slowdown over the baseline allowed for each operation')
+    args = parser.parse_args(argv)
+
+    strings = corpus.generate(args.count, args.seed)
+    results = measure(strings, args.repeat, args.only)
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as handle:
+            saved = json.load(handle)
+        if (saved['count'], saved['seed']) != (args.count, args.seed):
+            print('warning: the baseline used another corpus', file=sys.stderr)
+        baseline = saved['results']
+
+    regressions = []
+    print('{:<18}{:>14}{:>12}{:>10}'.format(
+        'operation', 'ops/sec', 'peak B/op', 'change'))
+    for name, _, _ in OPERATIONS:
+        if name not in results:
+            continue
+        result = results[name]
+        line = '{:<18}{:>14,.0f}{:>12.0f}'.format(
+            name, result['ops'], result['bytes'])
+        if name in baseline:
+            change = result['ops'] / baseline[name]['ops'] - 1
+            line += '{:>+10.1%}'.format(change)
+            if result['ops'] * (1 + args.tolerance) < baseline[name]['ops']:
+                regressions.append(name)
+                line += '  slower'
+        print(line)
+
+    if args.save:
+        with open(args.save, 'w') as handle:
+            json.dump({
+                'count': args.count,
+                'seed': args.seed,
+                'python': platform.python_version(),
+                'results': results,
+            }, handle, indent=2, sort_keys=True)
+
+    if regressions:
+        print('regressed: {}'.format(', '.join(regressions)), file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
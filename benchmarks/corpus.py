@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+#
+# Generate a reproducible corpus of realistic urls for the benchmarks.
+#
+#   python benchmarks/corpus.py [--count N] [--seed S] > urls.txt
+#
+
+'''A seeded generator of urls with IDN hosts, long query strings, tracking
+parameters, dot segments and percent escapes. The same count and seed
+always give the same urls.'''
+
+from __future__ import print_function
+
+import argparse
+import random
+
+HOSTS = [
+    'www.example.com', 'example.org', 'news.example.co.uk', 'blog.example.net',
+    'www.amazon.com', 'www.amazon.de', 'www.google.com', 'www.youtube.com',
+    'twitter.com', 'www.facebook.com', 'shop.ebay.com', 'www.reddit.com',
+    'EXAMPLE.COM', 'api.example.io', 'cdn.static.example.com',
+    'xn--bcher-kva.de',
+]
+
+IDN_HOSTS = [
+    'www.bücher.de', 'пример.рф', '例え.テスト', 'münchen.example.com',
+    'straße.de', 'ελληνικά.gr', 'www.kündigen.de', 'δοκιμή.example.org',
+]
+
+PORTS = ['', '', '', '', ':80', ':443', ':8080']
+
+SEGMENTS = [
+    'a', 'b', 'products', 'item', 'search', 'blog', '2024', 'index.html',
+    'user', 'profile', 'dp', 'B01N5IB20Q', 'watch', 'wiki', 'Main_Page',
+]
+
+# Segments that abspath and escape have work to do on
+DIRTY_SEGMENTS = [
+    '.', '..', '', 'caf%C3%A9', 'a%20b', '%7Euser', 'ümlaut', 'a b', '%2F',
+    'price%24', '%e9',
+]
+
+PARAMS = [
+    'q', 'page', 'id', 'sort', 'lang', 'ref', 'tag', 'v', 'list', 'offset',
+    'limit', 'category', 'color', 'size', 'session',
+]
+
+TRACKING = [
+    'utm_source', 'utm_medium', 'utm_campaign', 'utm_term', 'utm_content',
+    'fbclid', 'gclid', 'mc_eid', 'ref_', 'pf_rd_p', 'pf_rd_r', '_openstat',
+    'yclid', 'igshid',
+]
+
+VALUES = [
+    '1', '42', 'foo', 'bar%20baz', 'caf%C3%A9', 'a+b', '', 'true',
+    'Zm9vYmFy', '2024-01-01', 'x%2Fy', 'ümlaut',
+]
+
+
+def url(rng):
+    '''Return one random url'''
+    scheme = rng.choice(['http', 'https', 'https', 'https'])
+    host = rng.choice(IDN_HOSTS if rng.random() < 0.2 else HOSTS)
+    userinfo = 'user:pass@' if rng.random() < 0.03 else ''
+
+    path = []
+    for _ in range(rng.randint(0, 6)):
+        if rng.random() < 0.2:
+            path.append(rng.choice(DIRTY_SEGMENTS))
+        else:
+            path.append(rng.choice(SEGMENTS))
+    result = '{}://{}{}{}/{}'.format(
+        scheme, userinfo, host, rng.choice(PORTS), '/'.join(path))
+    if rng.random() < 0.05:
+        result += ';jsessionid=' + rng.choice(VALUES)
+
+    # Mostly short queries, with a long tail of long ones
+    count = int(rng.expovariate(1 / 4.0))
+    query = []
+    for _ in range(min(count, 40)):
+        name = rng.choice(TRACKING if rng.random() < 0.3 else PARAMS)
+        query.append('{}={}'.format(name, rng.choice(VALUES)))
+    if query:
+        result += '?' + '&'.join(query)
+    if rng.random() < 0.2:
+        result += '#' + rng.choice(['top', 'section-2', 'comments', ''])
+    return result
+
+
+def generate(count=10000, seed=0):
+    '''Return a list of count urls generated from the seed'''
+    rng = random.Random(seed)
+    return [url(rng) for _ in range(count)]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--count', type=int, default=10000,
+        help='the number of urls to generate')
+    parser.add_argument('--seed', type=int, default=0,
+        help='the seed of the generator')
+    args = parser.parse_args(argv)
+    for line in generate(args.count, args.seed):
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
@@ -36,9 +36,9 @@ import codecs
 import re
 import sys
 import os
-import json
-import ast
-from functools import lru_cache
+import zlib
+from functools import lru_cache, wraps
+from itertools import islice
 
 
 try:
@@ -68,16 +68,90 @@ py2 = _sys_v0 == 2
 py3 = _sys_v0 == 3
 
 
-# For publicsuffix utilities
-from publicsuffix2 import PublicSuffixList
-psl = PublicSuffixList()
+# For publicsuffix utilities, loaded on first use
+@lru_cache(maxsize=1)
+def get_psl():
+    '''Return the PublicSuffixList, built on first use'''
+    from publicsuffix2 import PublicSuffixList
+    return PublicSuffixList()
+
+
+# The number of hosts whose public suffix is cached
+PLD_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=PLD_CACHE_SIZE)
+def _public_suffix(host):
+    return get_psl().get_public_suffix(host)
+
+
+# Some codecs that we'll need, looked up on first use
+_CODECS = {
+    'IDNA': 'idna',
+    'UTF8': 'utf-8',
+    'ASCII': 'ascii',
+    'W1252': 'windows-1252'
+}
 
 
-# Come codes that we'll need
-IDNA = codecs.lookup('idna')
-UTF8 = codecs.lookup('utf-8')
-ASCII = codecs.lookup('ascii')
-W1252 = codecs.lookup('windows-1252')
+def __getattr__(name):
+    # psl and the codecs used to be looked up at import time
+    if name == 'psl':
+        return get_psl()
+    if name in _CODECS:
+        return codecs.lookup(_CODECS[name])
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+# The types of raw url data that parse decodes
+BINARY_TYPES = (bytes, bytearray, memoryview)
+
+# The codecs error handler decode uses for bytes Windows-1252 leaves undefined
+PERCENT_ESCAPE_ERRORS = 'urlpy2-percent-escape'
+
+
+def _percent_escape(error):
+    '''Percent-escape the bytes that could not be decoded'''
+    undecoded = bytearray(error.object[error.start:error.end])
+    return ''.join(['%%%02X' % byte for byte in undecoded]), error.end
+
+
+@lru_cache(maxsize=1)
+def _register_percent_escape():
+    codecs.register_error(PERCENT_ESCAPE_ERRORS, _percent_escape)
+
+
+def decode(data):
+    '''Decode raw url data, bytes, bytearray or memoryview, and return a
+    tuple of the text and the encoding used. The data is decoded as UTF-8,
+    or else as Windows-1252 with the five bytes it does not define
+    percent-escaped. Neither copies the data beforehand.'''
+    try:
+        return str(data, 'utf-8'), 'utf-8'
+    except UnicodeDecodeError:
+        _register_percent_escape()
+        return str(data, 'windows-1252', PERCENT_ESCAPE_ERRORS), 'windows-1252'
+
+
+class _LazyPattern(object):
+    '''A regular expression compiled on first use rather than at import.
+    Its attributes are those of the compiled pattern, and are kept on the
+    instance once looked up so later uses cost nothing extra.'''
+
+    def __init__(self, pattern, flags=0):
+        self._pattern = pattern
+        self._flags = flags
+
+    def __getattr__(self, name):
+        if name.startswith('_'):
+            raise AttributeError(name)
+        value = getattr(re.compile(self._pattern, self._flags), name)
+        setattr(self, name, value)
+        return value
+
+    def __repr__(self):
+        return '<urlpy.LazyPattern {!r}>'.format(self._pattern)
 
 # The default ports associated with each scheme
 PORTS = {
@@ -85,18 +159,770 @@ PORTS = {
     'https': 443
 }
 
+# The number of host conversions cached by punycode and unpunycode
+IDNA_CACHE_SIZE = 4096
+
+
+def _punycode_host(host):
+    '''Return the IDNA encoding of a host'''
+    if host.isascii():
+        # Same as the fast path of the IDNA codec for ASCII names, which are
+        # returned as-is once their label lengths are checked
+        labels = host.split('.')
+        for label in labels[:-1]:
+            if not (0 < len(label) < 64):
+                raise UnicodeError('label empty or too long')
+        if len(labels[-1]) >= 64:
+            raise UnicodeError('label too long')
+        return host
+    return _idna_encode(host)
+
+
+def _unpunycode_host(host):
+    '''Return the IDNA decoding of a host'''
+    if host.isascii() and 'xn--' not in host:
+        # Same as the fast path of the IDNA codec
+        return host
+    return _idna_decode(host)
+
+
+@lru_cache(maxsize=IDNA_CACHE_SIZE)
+def _idna_encode(host):
+    return (codecs.lookup('idna').encode(host)[0]).decode('utf-8')
+
+
+@lru_cache(maxsize=IDNA_CACHE_SIZE)
+def _idna_decode(host):
+    return codecs.lookup('idna').decode(host.encode('utf-8'))[0]
+
+
+def idna_cache_info():
+    '''Return a dict of the hits, misses and size of the punycode and
+    unpunycode host caches. Pure ASCII hosts skip the cache and the codec.'''
+    return {
+        'punycode': _idna_encode.cache_info()._asdict(),
+        'unpunycode': _idna_decode.cache_info()._asdict(),
+    }
+
+
+# The components of an URL, in the order of its constructor arguments
+COMPONENTS = (
+    'scheme', 'host', 'port', 'path', 'params', 'query', 'fragment', 'userinfo')
+
 RULES_FILE = os.path.join(os.path.dirname(__file__), 'urlpy2-rules/data.min.json')
 
-def parse(url):
-    '''Parse the provided url string and return an URL object'''
-    return URL.parse(url)
+# Via http://www.ietf.org/rfc/rfc3986.txt appendix B, with a strict scheme
+_SPLIT_RE = _LazyPattern(
+    r'(?:([A-Za-z][A-Za-z0-9+\-.]*):)?'  # scheme
+    r'(?://([^/?#]*))?'  # netloc
+    r'([^?#]*)'  # path and params
+    r'(?:\?([^#]*))?'  # query
+    r'(?:#(.*))?',  # fragment
+    re.S)
+
+# The scheme and netloc of _SPLIT_RE, which is all split_head reads
+_HEAD_RE = _LazyPattern(
+    r'(?:([A-Za-z][A-Za-z0-9+\-.]*):)?'  # scheme
+    r'(?://([^/?#]*))?')  # netloc
+
+# Stripped and removed from urls like urlparse does (WHATWG)
+_C0_CONTROL_OR_SPACE = ''.join(chr(c) for c in range(0x21))
+_UNSAFE_URL_CHARS = ('\t', '\r', '\n')
+
+_USES_PARAMS = frozenset(urlparse.uses_params)
+
+
+def parse(url, lazy=False):
+    '''Parse the provided url string, or raw url bytes, and return an URL
+    object'''
+    return URL.parse(url, lazy)
+
+
+def _clean_url(url):
+    '''Return the url without leading C0 control characters and spaces, and
+    without tabs and newlines, as urlparse reads it'''
+    url = url.lstrip(_C0_CONTROL_OR_SPACE)
+    for char in _UNSAFE_URL_CHARS:
+        if char in url:
+            url = url.replace(char, '')
+    return url
+
+
+# The number of netlocs whose split is cached, hosts repeat a lot
+NETLOC_CACHE_SIZE = 65536
+
+
+@lru_cache(maxsize=NETLOC_CACHE_SIZE)
+def _split_netloc(netloc):
+    '''Return the (host, port, userinfo) of a netloc as split_url does'''
+    host = port = userinfo = None
+    if netloc:
+        _check_netloc(netloc)
+        info, have_info, hostinfo = netloc.rpartition('@')
+        if have_info:
+            userinfo, _, password = info.partition(':')
+            if userinfo and password:
+                userinfo += ':' + password
+        _, have_open_br, bracketed = hostinfo.partition('[')
+        if have_open_br:
+            host, _, port = bracketed.partition(']')
+            _, _, port = port.partition(':')
+        else:
+            host, _, port = hostinfo.partition(':')
+        if host:
+            # Scoped IPv6 addresses keep the case of their zone
+            host, percent, zone = host.partition('%')
+            host = host.lower() + percent + zone
+        else:
+            host = None
+        if port and port.isdigit() and port.isascii() and int(port) <= 65535:
+            port = int(port)
+        else:
+            port = None
+    return host, port, userinfo
+
+
+def split_url(url):
+    '''Split the url string in a single pass and return a tuple of (scheme,
+    host, port, path, params, query, fragment, userinfo) as urlparse and its
+    hostname, port, username and password attributes would. The host is
+    lowercased and the port is None if absent or invalid.'''
+    url = _clean_url(url)
+    scheme, netloc, path, query, fragment = _SPLIT_RE.match(url).groups()
+    if scheme is None:
+        scheme = ''
+    else:
+        rest = url[len(scheme) + 1:]
+        if rest and rest.isdigit() and rest.isascii():
+            # Something like 'foo:0108' is a path with a port number, not a
+            # scheme
+            scheme = ''
+            netloc, path, query, fragment = None, url, None, None
+        else:
+            scheme = scheme.lower()
+
+    params = ''
+    if scheme in _USES_PARAMS and ';' in path:
+        if '/' in path:
+            i = path.find(';', path.rfind('/'))
+        else:
+            i = path.find(';')
+        if i >= 0:
+            path, params = path[:i], path[i + 1:]
+
+    host, port, userinfo = _split_netloc(netloc)
+    return (scheme, host, port, path, params,
+        query or '', fragment or '', userinfo)
+
+
+def split_head(url):
+    '''Return the (scheme, host, port, userinfo) of the url string as
+    split_url does, reading no further than the end of the netloc'''
+    url = _clean_url(url)
+    scheme, netloc = _HEAD_RE.match(url).groups()
+    if scheme is None:
+        scheme = ''
+    else:
+        rest = url[len(scheme) + 1:]
+        if rest and rest.isdigit() and rest.isascii():
+            scheme = ''
+        else:
+            scheme = scheme.lower()
+    host, port, userinfo = _split_netloc(netloc)
+    return scheme, host, port, userinfo
+
+
+def host_of(url):
+    '''Return the host of the url string, as URL.parse(url).host would,
+    without parsing more than the netloc'''
+    return split_head(url)[1]
+
+
+def _pld_of_host(host):
+    return _public_suffix(host) if host else ''
+
+
+def _tld_of_host(host):
+    return '.'.join(_public_suffix(host).split('.')[1:]) if host else ''
+
+
+def pld_of(url):
+    '''Return the pay-level domain of the url string, as URL.parse(url).pld
+    would, without parsing more than the netloc'''
+    return _pld_of_host(host_of(url))
+
+
+def tld_of(url):
+    '''Return the top-level domain of the url string, as URL.parse(url).tld
+    would, without parsing more than the netloc'''
+    return _tld_of_host(host_of(url))
+
+
+def _check_netloc(netloc):
+    '''Raise a ValueError for a netloc that urlparse would reject'''
+    if '[' in netloc or ']' in netloc:
+        if '[' not in netloc or ']' not in netloc:
+            raise ValueError('Invalid IPv6 URL')
+        bracketed = netloc.partition('[')[2].partition(']')[0]
+        if bracketed.startswith('v'):
+            if not re.match(r'\Av[a-fA-F0-9]+\..+\Z', bracketed):
+                raise ValueError('IPvFuture address is invalid')
+        else:
+            import ipaddress
+            # Raises a ValueError if not an IPv6 or IPv4 address
+            address = ipaddress.ip_address(bracketed)
+            if isinstance(address, ipaddress.IPv4Address):
+                raise ValueError('An IPv4 address cannot be in brackets')
+    if not netloc.isascii():
+        # Look for characters like \u2100 that expand to 'a/c' under the
+        # NFKC normalization IDNA uses
+        import unicodedata
+        n = netloc
+        for char in '@:#?':
+            n = n.replace(char, '')
+        normalized = unicodedata.normalize('NFKC', n)
+        if n != normalized:
+            for char in '/?#@:':
+                if char in normalized:
+                    raise ValueError(
+                        "netloc '%s' contains invalid characters under NFKC "
+                        "normalization" % netloc)
 
 @lru_cache(maxsize=1)
 def access_rules_file():
+    import json
     with open(RULES_FILE, 'r') as json_data:
         json_data = json.load(json_data)
         return json_data
 
+
+# Bumped whenever the layout of the compiled rules cache changes
+RULES_CACHE_VERSION = 3
+
+
+def rules_cache_dir():
+    '''Return the directory of the compiled rules cache: $URLPY2_CACHE_DIR,
+    else urlpy2 in $XDG_CACHE_HOME or ~/.cache. None if URLPY2_CACHE_DIR is
+    set but empty, which disables the cache.'''
+    directory = os.environ.get('URLPY2_CACHE_DIR')
+    if directory is not None:
+        return directory or None
+    base = os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache')
+    return os.path.join(base, 'urlpy2')
+
+
+def _rules_cache_path(location):
+    directory = rules_cache_dir()
+    if directory is None:
+        return None
+    return os.path.join(
+        directory, 'rules-%08x.marshal' % zlib.crc32(location.encode('utf-8')))
+
+
+def _read_rules_cache(path, header):
+    '''Return the Ruleset cached at path if it was compiled from the same
+    source file by the same Python, else None'''
+    import marshal
+    try:
+        with open(path, 'rb') as cached:
+            payload = marshal.loads(cached.read())
+        if (type(payload) is not tuple or len(payload) != 2
+                or payload[0] != header):
+            return None
+        return Ruleset.from_fields(payload[1])
+    except (OSError, EOFError, ValueError, TypeError, IndexError, KeyError):
+        return None
+
+
+def _write_rules_cache(path, header, ruleset):
+    '''Cache the compiled ruleset at path. The cache is only an optimization
+    so failing to write it is not an error.'''
+    import marshal
+    import tempfile
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        descriptor, temporary = tempfile.mkstemp(
+            dir=os.path.dirname(path), prefix='.rules-')
+        try:
+            with os.fdopen(descriptor, 'wb') as cached:
+                cached.write(marshal.dumps((header, ruleset.fields())))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+    except OSError:
+        pass
+
+
+def read_rules(location=RULES_FILE):
+    '''Return the Ruleset for the ClearURLs rules file at location.
+
+    The compiled ruleset is cached on disk, see rules_cache_dir, and read
+    from there while the rules file keeps its modification time and size.'''
+    location = os.path.abspath(location)
+    stat = os.stat(location)
+    header = (RULES_CACHE_VERSION, sys.hexversion, location,
+        stat.st_mtime_ns, stat.st_size)
+    path = _rules_cache_path(location)
+    if path is not None:
+        ruleset = _read_rules_cache(path, header)
+        if ruleset is not None:
+            return ruleset
+
+    import json
+    with open(location, 'r') as json_data:
+        ruleset = Ruleset(json.load(json_data))
+    if path is not None:
+        _write_rules_cache(path, header, ruleset)
+    return ruleset
+
+
+@lru_cache(maxsize=None)
+def load_rules(location=RULES_FILE):
+    '''Return the compiled Ruleset for the ClearURLs rules file at location.
+    The ruleset is built once per process and location.'''
+    return read_rules(location)
+
+
+# A url pattern anchored on a literal host label: the scheme and '//', an
+# optional group of leading labels that always ends with an escaped dot, then
+# the label itself followed by an escaped dot. The group may only hold
+# literal host characters and classes of them, such as [a-z0-9-]+, so that
+# it cannot match past the netloc the labels are looked up in.
+_INDEXABLE_PATTERN_RE = _LazyPattern(
+    r'\^?https\?:(?:\\?/){2}'
+    r'(?:\((?:\?:)?'
+    r'(?:[a-z0-9-]|\\[.-]|\[-?(?:(?:a-z|0-9)-?|[a-z0-9.]|\\[.-])+-?\]'
+    r'(?:[*+?]|\{\d*,?\d*\})?\??)*'
+    r'\\\.\)(?:[*+]\??|\?)?)?'
+    r'((?:[a-z0-9-]|\\-)+)'
+    r'(?:\\\.|\(\?:\\\.[^()|]*\)(?:\{1,\}|\+))')
+
+# The host labels of a url, as they can be matched by a literal label
+_LABEL_RE = _LazyPattern(r'[a-z0-9-]+')
+
+
+def host_label(url_pattern):
+    '''Return the literal host label that any url matched by the url_pattern
+    regex string must contain, or None if there is no such label.'''
+    match = _INDEXABLE_PATTERN_RE.match(url_pattern)
+    if match:
+        return match.group(1).replace('\\-', '-')
+    return None
+
+
+def _unparse(scheme, host, port, path, params, query, fragment, userinfo):
+    '''Return the url string for the components of an URL'''
+    netloc = host or ''
+    if port:
+        netloc += (':' + str(port))
+
+    if userinfo is not None:
+        netloc = '{}@{}'.format(userinfo, netloc)
+
+    result = urlparse.urlunparse((
+        str(scheme),
+        str(netloc),
+        str(path),
+        str(params),
+        str(query),
+        fragment))
+    if isinstance(result, bytes):
+        result = result.decode('utf-8')
+    return result
+
+
+# Parameter name regexes without special characters, which only match
+# themselves
+_LITERAL_NAME_RE = _LazyPattern(r'[^\\.^$*+?{}\[\]|()]*\Z')
+
+# The number of parameter sets whose matcher is cached
+PARAM_MATCHER_CACHE_SIZE = 256
+
+
+class ParamMatcher(object):
+    '''Tells whether lowered parameter names are among literal names, with a
+    set lookup, or match any of a list of regexes, compiled once into a
+    single alternation on first use.
+
+    The regexes are anchored with $, which also matches before a final
+    newline. The anchored literal names are matched the same way.'''
+
+    def __init__(self, literals=(), patterns=(), anchored=()):
+        self.literals = frozenset(literals)
+        self.patterns = tuple(patterns)
+        self.anchored = frozenset(anchored)
+        self.regex = None
+        if self.patterns:
+            self.regex = _LazyPattern('^(' + '|'.join(self.patterns) + ')$')
+        self.matches = self._matches_function()
+
+    def __repr__(self):
+        return '<urlpy.ParamMatcher {} literals, {} patterns>'.format(
+            len(self.literals), len(self.patterns))
+
+    def __reduce__(self):
+        # matches is a closure, which cannot be pickled
+        return (ParamMatcher, (self.literals, self.patterns, self.anchored))
+
+    def _matches_function(self):
+        '''Return the function telling whether a lowered name matches'''
+        literals = self.literals
+        if self.regex is None and not self.anchored:
+            return literals.__contains__
+        anchored = self.anchored
+        regex = self.regex
+
+        def matches(name):
+            if name in literals:
+                return True
+            if name[-1:] == '\n' and name[:-1] in anchored:
+                return True
+            return regex is not None and regex.search(name) is not None
+        return matches
+
+
+def _split_patterns(patterns):
+    '''Return the sorted literal names and regexes of lowered parameter name
+    regexes'''
+    literals, regexes = set(), set()
+    for pattern in patterns:
+        if _LITERAL_NAME_RE.match(pattern):
+            literals.add(pattern)
+        else:
+            regexes.add(pattern)
+    if not patterns:
+        # The empty alternation matches the empty name
+        literals.add('')
+    return sorted(literals), sorted(regexes)
+
+
+@lru_cache(maxsize=PARAM_MATCHER_CACHE_SIZE)
+def param_matcher(names, regex=False):
+    '''Return the ParamMatcher for a tuple of parameter names, as deparam
+    matches them, or of parameter name regexes if regex, as r_deparam does.
+    Matchers are cached by parameter set.'''
+    lowered = set([name.lower() for name in names])
+    if not regex:
+        return ParamMatcher(lowered)
+    literals, patterns = _split_patterns(lowered)
+    return ParamMatcher(literals, patterns, literals)
+
+
+class Provider(object):
+    '''A ClearURLs provider with its url pattern, exceptions and parameter
+    rules compiled on first use.'''
+
+    def __init__(self, name, data):
+        # Rules are matched against lowered parameter names, as r_deparam does
+        literals, patterns = _split_patterns(
+            set([r.lower() for r in data.get('rules', [])]))
+        self._load((
+            name,
+            data['urlPattern'],
+            host_label(data['urlPattern']),
+            data.get('completeProvider', False),
+            list(data.get('exceptions', [])),
+            literals,
+            patterns,
+            sorted(set([r.lower() for r in data.get('referralMarketing', [])]))))
+
+    def _load(self, fields):
+        (self.name, url_pattern, self.host_label, self.complete_provider,
+            exceptions, literals, patterns, referral_marketing) = fields
+        self._fields = fields
+        self.url_pattern = _LazyPattern(url_pattern)
+        self.exceptions = [_LazyPattern(e) for e in exceptions]
+        self.referral_marketing = set(referral_marketing)
+        self.rules = ParamMatcher(literals, patterns, literals)
+        # The rules and the referral marketing names, matched exactly
+        self._tracking = ParamMatcher(
+            self.referral_marketing.union(literals), patterns, literals)
+
+    @classmethod
+    def from_fields(cls, fields):
+        '''Return the provider for fields as returned by fields()'''
+        provider = cls.__new__(cls)
+        provider._load(fields)
+        return provider
+
+    def fields(self):
+        '''Return the processed provider as a tuple of plain values, with
+        its regexes as strings'''
+        return self._fields
+
+    def __reduce__(self):
+        return (Provider.from_fields, (self._fields,))
+
+    def __repr__(self):
+        return '<urlpy.Provider "{}">'.format(self.name)
+
+    def matches(self, url, observer=None):
+        '''Return True if this provider applies to the url string, that is
+        its url pattern matches and none of its exceptions do. The observer,
+        such as a Stats, is told when an exception keeps it from applying.'''
+        if not self.url_pattern.match(url):
+            return False
+        for exception in self.exceptions:
+            if exception.match(url):
+                if observer is not None:
+                    observer.exception(self)
+                return False
+        return True
+
+    def matcher(self, remove_referall_marketing=True):
+        '''Return the ParamMatcher of the tracking parameters to remove'''
+        if remove_referall_marketing:
+            return self._tracking
+        return self.rules
+
+    def strips(self, name, remove_referall_marketing=True):
+        '''Return True if the parameter name is tracking to be removed'''
+        return self.matcher(remove_referall_marketing).matches(name.lower())
+
+
+class Ruleset(object):
+    '''A set of ClearURLs providers compiled from the rules JSON data.
+    Providers are tried in the order of the rules file.
+
+    Providers are indexed by the host label their url pattern anchors on so
+    that only the few which could match a url are evaluated. Providers whose
+    pattern cannot be indexed are always evaluated.'''
+
+    def __init__(self, data):
+        self._load([
+            Provider(name, provider)
+            for name, provider in data['providers'].items()])
+
+    def _load(self, providers):
+        self.providers = providers
+        self.index = {}
+        self.fallback = []
+        for position, provider in enumerate(self.providers):
+            if provider.complete_provider:
+                continue
+            if provider.host_label:
+                self.index.setdefault(provider.host_label, []).append(position)
+            else:
+                self.fallback.append(position)
+
+    @classmethod
+    def from_fields(cls, fields):
+        '''Return the ruleset for fields as returned by fields()'''
+        ruleset = cls.__new__(cls)
+        ruleset._load([Provider.from_fields(f) for f in fields])
+        return ruleset
+
+    def fields(self):
+        '''Return the processed providers as plain values that marshal can
+        store'''
+        return [provider.fields() for provider in self.providers]
+
+    def __reduce__(self):
+        # Pickled from the fields, as for the rules cache, so that workers
+        # of normalize_parallel get the ruleset of a remove_tracking step
+        # whatever the start method of their processes
+        return (Ruleset.from_fields, (self.fields(),))
+
+    def __len__(self):
+        return len(self.providers)
+
+    def candidates(self, url):
+        '''Return the providers that could apply to the url string, in the
+        order of the rules file.'''
+        positions = list(self.fallback)
+        start = url.find('//')
+        if start >= 0:
+            start += 2
+            end = len(url)
+            for delimiter in '/?#':
+                found = url.find(delimiter, start, end)
+                if found >= 0:
+                    end = found
+            for label in _LABEL_RE.findall(url, start, end):
+                positions.extend(self.index.get(label, ()))
+        providers = self.providers
+        return [providers[position] for position in sorted(set(positions))]
+
+    def match(self, url, observer=None):
+        '''Return the first provider that applies to the url string or None.
+        Complete providers block whole urls and are never used to clean one.
+        See Provider.matches for the observer.'''
+        for provider in self.candidates(url):
+            if provider.matches(url, observer):
+                return provider
+        return None
+
+
+def _clean_pattern(safe):
+    '''Return a pattern matching the components that escaping with the safe
+    characters leaves unchanged: safe characters and the uppercase escapes
+    of the ASCII characters that are not. The safe characters always include
+    the unreserved ones, which quote never escapes.'''
+    safe = safe.decode('utf-8')
+    escapes = ['%02X' % c for c in range(128) if chr(c) not in safe]
+    return _LazyPattern(
+        '(?:[' + re.escape(safe) + ']|%(?:' + '|'.join(escapes) + '))*\\Z')
+
+
+def _escape_component(component, safe, clean):
+    '''Return the component unquoted and quoted again with the safe
+    characters. Components the clean pattern matches are returned as-is.'''
+    if clean.match(component):
+        return component
+    result = urllib_quote(urllib_unquote(component).encode('utf-8'), safe=safe)
+    if py2:
+        result = result.decode('utf-8')
+    return result
+
+
+def _canonical_segments(segments, separator):
+    '''Return the query or params segments sorted, as canonical() does'''
+    return separator.join(sorted(segments.split(separator)))
+
+
+def _pair(segment):
+    '''Return the (name, value) pair of a query or params segment. The value
+    is None if there is no '=' in the segment.'''
+    name, equals, value = segment.partition('=')
+    return (name, value if equals else None)
+
+
+def _abspath(path):
+    '''Return the path without '.' and '..' segments or repeated slashes'''
+    # Remove double forward-slashes from the path
+    path = re.sub(r'\/{2,}', '/', path)
+    # With that done, go through and remove all the relative references
+    unsplit = []
+    directory = False
+    for part in path.split('/'):
+        # If we encounter the parent directory, and there's
+        # a segment to pop off, then we should pop it off.
+        if part == '..' and (not unsplit or unsplit.pop() != None):
+            directory = True
+        elif part != '.':
+            unsplit.append(part)
+            directory = False
+        else:
+            directory = True
+
+    # With all these pieces, assemble!
+    if directory:
+        # If the path ends with a period, then it refers to a directory,
+        # not a file path
+        return '/'.join(unsplit) + '/'
+    return '/'.join(unsplit)
+
+
+def _unescape_path(path):
+    '''Return the path with its percent escapes decoded'''
+    if py2:
+        path = path.encode('utf-8')
+    path = urllib_unquote(path)
+    if py2:
+        path = path.decode('utf-8')
+    return path
+
+
+# The positions of the components in COMPONENTS
+_SCHEME, _HOST, _PORT, _PATH, _PARAMS, _QUERY, _FRAGMENT, _USERINFO = range(8)
+
+
+# The steps of URL.normalize, each a function updating a list of components
+# in place the way the URL method of the same name updates an URL
+
+def _canonical_step(components):
+    components[_QUERY] = _canonical_segments(components[_QUERY], '&')
+    components[_PARAMS] = _canonical_segments(components[_PARAMS], ';')
+
+
+def _defrag_step(components):
+    components[_FRAGMENT] = None
+
+
+def _deuserinfo_step(components):
+    components[_USERINFO] = None
+
+
+def _abspath_step(components):
+    components[_PATH] = _abspath(components[_PATH])
+
+
+def _escape_step(components):
+    components[_PATH] = _escape_component(
+        components[_PATH], URL.PATH, URL._PATH_CLEAN_RE)
+    components[_QUERY] = _escape_component(
+        components[_QUERY], URL.QUERY, URL._QUERY_CLEAN_RE)
+    components[_PARAMS] = _escape_component(
+        components[_PARAMS], URL.QUERY, URL._QUERY_CLEAN_RE)
+    if components[_USERINFO]:
+        components[_USERINFO] = _escape_component(
+            components[_USERINFO], URL.USERINFO, URL._USERINFO_CLEAN_RE)
+
+
+def _sanitize_step(components):
+    _abspath_step(components)
+    _escape_step(components)
+
+
+def _unescape_step(components):
+    components[_PATH] = _unescape_path(components[_PATH])
+
+
+def _remove_default_port_step(components):
+    port, scheme = components[_PORT], components[_SCHEME]
+    if port and scheme and (port == PORTS.get(scheme)):
+        components[_PORT] = None
+
+
+def _punycode_step(components):
+    if not components[_HOST]:
+        raise TypeError('Cannot punycode a relative url (%s)' % (
+            '<urlpy.URL object "{}">'.format(_unparse(*components)),))
+    components[_HOST] = _punycode_host(components[_HOST])
+
+
+def _unpunycode_step(components):
+    if not components[_HOST]:
+        raise TypeError('Cannot unpunycode a relative url (%s)' % (
+            '<urlpy.URL object "{}">'.format(_unparse(*components)),))
+    components[_HOST] = _unpunycode_host(components[_HOST])
+
+
+NORMALIZE_STEPS = {
+    'abspath': _abspath_step,
+    'canonical': _canonical_step,
+    'defrag': _defrag_step,
+    'deuserinfo': _deuserinfo_step,
+    'escape': _escape_step,
+    'punycode': _punycode_step,
+    'remove_default_port': _remove_default_port_step,
+    'sanitize': _sanitize_step,
+    'unescape': _unescape_step,
+    'unpunycode': _unpunycode_step,
+}
+
+# Named sets of normalization steps, in the order they are applied
+NORMALIZE_PROFILES = {
+    'equiv': ('canonical', 'defrag', 'abspath', 'escape', 'punycode'),
+    'sanitize': ('abspath', 'escape'),
+}
+
+
+@lru_cache(maxsize=None)
+def _normalize_plan(steps):
+    '''Return the step functions for a profile name or tuple of steps'''
+    if isinstance(steps, (str, unicode)):
+        if steps not in NORMALIZE_PROFILES:
+            raise ValueError('Unknown normalization profile: %r' % (steps,))
+        steps = NORMALIZE_PROFILES[steps]
+    for step in steps:
+        if step not in NORMALIZE_STEPS:
+            raise ValueError('Unknown normalization step: %r' % (step,))
+    return tuple(NORMALIZE_STEPS[step] for step in steps)
+
+
 class URL(object):
     '''
     For more information on how and what we parse / sanitize:
@@ -117,40 +943,171 @@ class URL(object):
     QUERY = (_PCHAR + "/?").encode('utf-8')
     FRAGMENT = (_PCHAR + "/?").encode('utf-8')
     USERINFO = (_UNRESERVED + _SUB_DELIMS + ":").encode('utf-8')
+    _PATH_CLEAN_RE = _clean_pattern(PATH)
+    _QUERY_CLEAN_RE = _clean_pattern(QUERY)
+    _USERINFO_CLEAN_RE = _clean_pattern(USERINFO)
+
+    # Relative urls have no host to punycode
+    _RELATIVE_EQUIV_STEPS = NORMALIZE_PROFILES['equiv'][:-1]
+
+    # The values computed from the components and cached until one changes:
+    # the string rendering, the equivalence key and the pay-level domain
+    _CACHES = ('_str', '_equiv_key', '_pld')
 
-    PERCENT_ESCAPING_RE = re.compile(r'(%([a-fA-F0-9]{2})|.)', re.S)
+    # params and query are held as a string, or as the list of their
+    # segments once they are filtered or sorted. Each form is built from the
+    # other only when it is needed, so chained filters split and join once.
+    _SEGMENTED = {
+        'params': ('_params', ';'),
+        'query': ('_query', '&'),
+    }
+
+    __slots__ = (
+        'scheme', 'host', 'port', 'path', '_params', '_query', 'fragment',
+        'userinfo') + _CACHES
+
+    # The encoding of a url parsed from raw bytes, see _SourceMixin
+    encoding = None
+
+    PERCENT_ESCAPING_RE = _LazyPattern(r'(%([a-fA-F0-9]{2})|.)', re.S)
+
+    # Cleanup of redundant separators in params and query
+    _SEMICOLONS_RE = _LazyPattern(r';{2,}')
+    _EDGE_SEMICOLON_RE = _LazyPattern(r'^;|;$')
+    _AMPERSANDS_RE = _LazyPattern(r'&{2,}')
+    _EDGE_AMPERSAND_RE = _LazyPattern(r'^&|&$')
 
     @classmethod
-    def parse(cls, url):
-        '''Parse the provided url, and return a URL instance'''
-        if isinstance(url, URL):
-            return url
-        parsed = urlparse.urlparse(url)
+    def parse(cls, url, lazy=False):
+        '''Parse the provided url, and return a URL instance.
 
-        try:
-            port = parsed.port
-        except ValueError:
-            port = None
+        A lazily parsed url only keeps the string at first. Reading the
+        scheme, host, port or userinfo, or the pld and tld, only splits up
+        to the netloc. Anything else, including changing the url, parses it
+        fully, and only then would an invalid url raise a ValueError.
 
-        userinfo = parsed.username
-        if userinfo and parsed.password:
-            userinfo += ':%s' % parsed.password
+        Raw bytes, bytearray or memoryview urls are decoded with decode, and
+        the encoding it used is kept as the encoding attribute. It is None
+        for urls parsed from strings.
 
-        return cls(parsed.scheme, parsed.hostname, port,
-            parsed.path, parsed.params, parsed.query, parsed.fragment, userinfo)
+        Both kinds are instances of a subclass of cls that holds this state,
+        so that other URLs do not pay for it.'''
+        if isinstance(url, URL):
+            return url
+        if isinstance(url, FrozenURL):
+            return url.thaw()
+        if isinstance(url, BINARY_TYPES):
+            url, encoding = decode(url)
+            if lazy:
+                return _source_class(cls)._new(url, encoding)
+            parsed = _source_class(cls)._new(None, encoding)
+            cls.__init__(parsed, *split_url(url))
+            return parsed
+        if lazy:
+            return _source_class(cls)._new(url)
+        return cls(*split_url(url))
 
     def __init__(self, scheme, host, port, path, params, query, fragment, userinfo=None):
-        self.scheme = scheme
-        self.host = host
-        self.port = port
-        self.path = path or '/'
-        self.params = re.sub(r'^;+', '', str(params))
-        self.params = re.sub(r'^;|;$', '', re.sub(r';{2,}', ';', self.params))
+        # Only run the cleanup when there are redundant separators
+        params = str(params).lstrip(';')
+        if ';;' in params or params.endswith((';', ';\n')):
+            params = self._EDGE_SEMICOLON_RE.sub(
+                '', self._SEMICOLONS_RE.sub(';', params))
         # Strip off extra leading ?'s
-        self.query = re.sub(r'^\?+', '', str(query))
-        self.query = re.sub(r'^&|&$', '', re.sub(r'&{2,}', '&', self.query))
-        self.fragment = fragment
-        self.userinfo = userinfo
+        query = str(query).lstrip('?')
+        if ('&&' in query or query.startswith('&')
+                or query.endswith(('&', '&\n'))):
+            query = self._EDGE_AMPERSAND_RE.sub(
+                '', self._AMPERSANDS_RE.sub('&', query))
+        # Nothing is cached yet, so skip the invalidation in __setattr__
+        _setattr = object.__setattr__
+        for cache in self._CACHES:
+            _setattr(self, cache, None)
+        _setattr(self, 'scheme', scheme)
+        _setattr(self, 'host', host)
+        _setattr(self, 'port', port)
+        _setattr(self, 'path', path or '/')
+        _setattr(self, '_params', params)
+        _setattr(self, '_query', query)
+        _setattr(self, 'fragment', fragment)
+        _setattr(self, 'userinfo', userinfo)
+
+    def _segmented(attribute, separator, doc):
+        '''Return the property of params or query, joined from its segments
+        when it was last set as segments'''
+        def get(self):
+            value = getattr(self, attribute)
+            if type(value) is list:
+                value = separator.join(value)
+                object.__setattr__(self, attribute, value)
+            return value
+
+        def set(self, value):
+            object.__setattr__(self, attribute, value)
+
+        return property(get, set, doc=doc)
+
+    params = _segmented('_params', ';', 'The params, without the leading ;')
+    query = _segmented('_query', '&', 'The query, without the leading ?')
+    del _segmented
+
+    def _segments(self, name):
+        '''Return the list of segments of params or query, split from the
+        string when it was last set as a string'''
+        attribute, separator = self._SEGMENTED[name]
+        parts = getattr(self, attribute)
+        if type(parts) is not list:
+            parts = parts.split(separator) if parts else []
+            object.__setattr__(self, attribute, parts)
+        return parts
+
+    def _set_segments(self, name, parts):
+        '''Set params or query to a list of segments'''
+        attribute, _ = self._SEGMENTED[name]
+        object.__setattr__(self, attribute, parts)
+        for cache in self._CACHES:
+            object.__setattr__(self, cache, None)
+
+    @property
+    def params_pairs(self):
+        '''Return the (name, value) pairs of the params'''
+        return [_pair(segment) for segment in self._segments('params')]
+
+    @property
+    def query_pairs(self):
+        '''Return the (name, value) pairs of the query'''
+        return [_pair(segment) for segment in self._segments('query')]
+
+    def __setattr__(self, name, value):
+        if name[0] != '_':
+            object.__setattr__(self, name, value)
+            # A component changed: drop everything cached from them
+            for cache in self._CACHES:
+                object.__setattr__(self, cache, None)
+        else:
+            object.__setattr__(self, name, value)
+
+    @classmethod
+    def _from_components(cls, components):
+        '''Return an URL with exactly these components, without the cleanup
+        of params and query done by __init__.'''
+        url = cls.__new__(cls)
+        _setattr = object.__setattr__
+        for cache in cls._CACHES:
+            _setattr(url, cache, None)
+        for name, value in zip(COMPONENTS, components):
+            _setattr(url, name, value)
+        return url
+
+    def __reduce__(self):
+        # copy and pickle would otherwise set the slots of a bare instance
+        # through __setattr__. The instance __dict__ of a subclass is kept.
+        return (type(self)._from_components, (self._components(),),
+            getattr(self, '__dict__', None) or None)
+
+    def _components(self):
+        '''Return a tuple of the components, in the constructor order'''
+        return tuple(getattr(self, name) for name in COMPONENTS)
 
     def copy(self):
         '''Return a new instance of an identical URL.'''
@@ -164,32 +1121,44 @@ class URL(object):
             self.fragment,
             self.userinfo)
 
+    def freeze(self):
+        '''Return an immutable and hashable FrozenURL of this url'''
+        frozen = FrozenURL(
+            self.scheme,
+            self.host,
+            self.port,
+            self.path,
+            self.params,
+            self.query,
+            self.fragment,
+            self.userinfo)
+        object.__setattr__(frozen, '_str', self._str)
+        return frozen
+
+    def equiv_key(self):
+        '''Return a hashable key that is the same for urls that are
+        equivalent, without modifying this url. The key is computed once and
+        cached until a component changes.
+
+        The key is made of the scheme, host, port, path, params and query once
+        canonicalized, defragged, made absolute, escaped and punycoded. The
+        default port of the scheme is the same as no port.'''
+        if self._equiv_key is None:
+            components = [
+                self.scheme, self.host, self.port, self.path, self.params,
+                self.query, self.fragment, self.userinfo]
+            steps = 'equiv' if self.host else URL._RELATIVE_EQUIV_STEPS
+            for step in _normalize_plan(steps):
+                step(components)
+            scheme, host, port, path, params, query = components[:6]
+            if not port or port == PORTS.get(scheme, None):
+                port = None
+            self._equiv_key = (scheme, host, port, path, params, query)
+        return self._equiv_key
+
     def equiv(self, other):
         '''Return true if this url is equivalent to another'''
-        _other = self.parse(other)
-        _other.canonical().defrag().abspath().escape().punycode()
-
-        _self = self.parse(self)
-        _self.canonical().defrag().abspath().escape().punycode()
-
-        result = (
-            _self.scheme == _other.scheme    and
-            _self.host == _other.host      and
-            _self.path == _other.path      and
-            _self.params == _other.params    and
-            _self.query == _other.query)
-
-        if result:
-            if _self.port and not _other.port:
-                # Make sure _self.port is the default for the scheme
-                return _self.port == PORTS.get(_self.scheme, None)
-            elif _other.port and not _self.port:
-                # Make sure _other.port is the default for the scheme
-                return _other.port == PORTS.get(_other.scheme, None)
-            else:
-                return _self.port == _other.port
-        else:
-            return False
+        return self.equiv_key() == self.parse(other).equiv_key()
 
     def __eq__(self, other):
         '''Return true if this url is /exactly/ equal to another'''
@@ -208,23 +1177,10 @@ class URL(object):
         return not self.__eq__(other)
 
     def __str__(self):
-        netloc = self.host or ''
-        if self.port:
-            netloc += (':' + str(self.port))
-
-        if self.userinfo is not None:
-            netloc = '{}@{}'.format(self.userinfo, netloc)
-
-        result = urlparse.urlunparse((
-            str(self.scheme),
-            str(netloc),
-            str(self.path),
-            str(self.params),
-            str(self.query),
-            self.fragment))
-        if isinstance(result, bytes):
-            result = result.decode('utf-8')
-        return result
+        if self._str is None:
+            self._str = _unparse(self.scheme, self.host, self.port, self.path,
+                self.params, self.query, self.fragment, self.userinfo)
+        return self._str
 
     def __repr__(self):
         return '<urlpy.URL object "{}">'.format(str(self))
@@ -232,8 +1188,8 @@ class URL(object):
     def canonical(self):
         '''Canonicalize this url. This includes reordering parameters and args
         to have a consistent ordering'''
-        self.query = '&'.join(sorted([q for q in self.query.split('&')]))
-        self.params = ';'.join(sorted([q for q in self.params.split(';')]))
+        self._set_segments('query', sorted(self._segments('query')))
+        self._set_segments('params', sorted(self._segments('params')))
         return self
 
     def defrag(self):
@@ -243,26 +1199,39 @@ class URL(object):
 
     def deparam(self, params):
         '''Strip any of the provided parameters out of the url'''
-        lowered = set([p.lower() for p in params])
-        def function(name, _):
-            return name.lower() in lowered
-        return self.filter_params(function)
+        return self._filter_names(param_matcher(tuple(params)).matches)
 
     def r_deparam(self, params):
         '''Strip any of the provided regex parameters out of the url'''
-        lowered = set([p.lower() for p in params])
-        def function(name, _):
-            regex = '^(' + '|'.join(lowered) + ')$'
-            return bool(re.search(regex, name.lower()))            
-        return self.filter_params(function)
+        return self._filter_names(
+            param_matcher(tuple(params), regex=True).matches)
 
     def filter_params(self, function):
         '''Remove parameters if function(name, value)'''
-        def keep(query):
-            name, _, value = query.partition('=')
+        def keep(segment):
+            name, _, value = segment.partition('=')
             return not function(name, value)
-        self.query = '&'.join(q for q in self.query.split('&') if q and keep(q))
-        self.params = ';'.join(q for q in self.params.split(';') if q and keep(q))
+        for name in ('query', 'params'):
+            segments = self._segments(name)
+            kept = [s for s in segments if s and keep(s)]
+            if len(kept) != len(segments):
+                self._set_segments(name, kept)
+        return self
+
+    def _count_params(self):
+        '''Return the number of non-empty query and params segments'''
+        return sum(1 for name in ('query', 'params')
+            for segment in self._segments(name) if segment)
+
+    def _filter_names(self, matches):
+        '''Remove parameters if matches(name.lower()), like filter_params
+        but without calling back for each value'''
+        for name in ('query', 'params'):
+            segments = self._segments(name)
+            kept = [s for s in segments
+                if s and not matches(s.partition('=')[0].lower())]
+            if len(kept) != len(segments):
+                self._set_segments(name, kept)
         return self
 
     def deuserinfo(self):
@@ -272,121 +1241,107 @@ class URL(object):
 
     def abspath(self):
         '''Clear out any '..' and excessive slashes from the path'''
-        # Remove double forward-slashes from the path
-        path = re.sub(r'\/{2,}', '/', self.path)
-        # With that done, go through and remove all the relative references
-        unsplit = []
-        directory = False
-        for part in path.split('/'):
-            # If we encounter the parent directory, and there's
-            # a segment to pop off, then we should pop it off.
-            if part == '..' and (not unsplit or unsplit.pop() != None):
-                directory = True
-            elif part != '.':
-                unsplit.append(part)
-                directory = False
-            else:
-                directory = True
-
-        # With all these pieces, assemble!
-        if directory:
-            # If the path ends with a period, then it refers to a directory,
-            # not a file path
-            self.path = '/'.join(unsplit) + '/'
-        else:
-            self.path = '/'.join(unsplit)
+        self.path = _abspath(self.path)
         return self
 
     def sanitize(self):
         '''A shortcut to abspath and escape'''
         return self.abspath().escape()
 
+    def normalize(self, steps='equiv'):
+        '''Apply normalization steps, the names of methods such as 'abspath'
+        or 'escape', or those of a profile in NORMALIZE_PROFILES. The result
+        is the same as calling the methods in order, but each component is
+        worked on as a string and set once.'''
+        if not isinstance(steps, (str, unicode)):
+            steps = tuple(steps)
+        components = [
+            self.scheme, self.host, self.port, self.path, self.params,
+            self.query, self.fragment, self.userinfo]
+        for step in _normalize_plan(steps):
+            step(components)
+        for name, value in zip(COMPONENTS, components):
+            if value != getattr(self, name):
+                setattr(self, name, value)
+        return self
+
     def remove_default_port(self):
         '''If a port is provided an is the default, remove it.'''
-        if self.port and self.scheme and (self.port == PORTS[self.scheme]):
+        if self.port and self.scheme and (self.port == PORTS.get(self.scheme)):
             self.port = None
         return self
 
     def escape(self):
         '''Make sure that the path is correctly escaped'''
-        upath = urllib_unquote(self.path).encode('utf-8')
-        self.path = urllib_quote(upath, safe=URL.PATH)
-        if py2:
-            self.path = self.path.decode('utf-8')
+        # Components that are already escaped are left untouched
+        path = _escape_component(self.path, URL.PATH, URL._PATH_CLEAN_RE)
+        if path is not self.path:
+            self.path = path
 
         # Safe characters taken from:
         #    http://tools.ietf.org/html/rfc3986#page-50
-        uquery = urllib_unquote(self.query).encode('utf-8')
-        self.query = urllib_quote(uquery, safe=URL.QUERY)
-        if py2:
-            self.query = self.query.decode('utf-8')
+        query = _escape_component(self.query, URL.QUERY, URL._QUERY_CLEAN_RE)
+        if query is not self.query:
+            self.query = query
 
         # The safe characters for URL parameters seemed a little more vague.
         # They are interpreted here as *pchar despite this page, since the
         # updated RFC seems to offer no replacement
         #    http://tools.ietf.org/html/rfc3986#page-54
-        uparams = urllib_unquote(self.params).encode('utf-8')
-        self.params = urllib_quote(uparams, safe=URL.QUERY)
-        if py2:
-            self.params = self.params.decode('utf-8')
+        params = _escape_component(self.params, URL.QUERY, URL._QUERY_CLEAN_RE)
+        if params is not self.params:
+            self.params = params
 
         if self.userinfo:
-            uuserinfo = urllib_unquote(self.userinfo).encode('utf-8')
-            self.userinfo = urllib_quote(uuserinfo, safe=URL.USERINFO)
-            if py2:
-                self.userinfo = self.userinfo.decode('utf-8')
+            userinfo = _escape_component(
+                self.userinfo, URL.USERINFO, URL._USERINFO_CLEAN_RE)
+            if userinfo is not self.userinfo:
+                self.userinfo = userinfo
         return self
 
     def unescape(self):
         '''Unescape the path'''
-        path = self.path
-        if py2:
-            path = self.path.encode('utf-8')
-        path = urllib_unquote(path)
-        if py2:
-            path = path.decode('utf-8')
-        self.path = path
+        self.path = _unescape_path(self.path)
         return self
 
     def relative(self, path):
-        '''Evaluate the new path relative to the current url'''
+        '''Evaluate the new path relative to the current url. To resolve
+        many paths against the same url, use a Resolver.'''
         newurl = urlparse.urljoin(str(self), path)
         return URL.parse(newurl)
 
     def punycode(self):
         '''Convert to punycode hostname'''
         if self.host:
-            self.host = (IDNA.encode(self.host)[0]).decode('utf-8')
+            host = _punycode_host(self.host)
+            if host != self.host:
+                self.host = host
             return self
         raise TypeError('Cannot punycode a relative url (%s)' % repr(self))
 
     def unpunycode(self):
         '''Convert to an unpunycoded hostname'''
         if self.host:
-            self.host = IDNA.decode(self.host.encode('utf-8'))[0]
+            host = _unpunycode_host(self.host)
+            if host != self.host:
+                self.host = host
             return self
         raise TypeError('Cannot unpunycode a relative url (%s)' % repr(self))
             
-    def remove_tracking(self, remove_referall_marketing=True):
-        ''' Clean up the url by removing tracking parameters based on a CleanURLS collaborative list: https://gitlab.com/ClearURLs/rules/-/blob/master/data.min.json '''                
-        rules_data = access_rules_file()
-        def match_in_a_list(exceptions, url):
-            for exception in exceptions:
-                if re.match(url, exception):
-                    return True
-            return False            
-        for provider in rules_data['providers']:            
-            url_pattern = rules_data['providers'][provider]['urlPattern']
-            exceptions = rules_data['providers'][provider]['exceptions']
-            complete_provider = rules_data['providers'][provider]['completeProvider']                                                     
-            if not complete_provider:
-                if re.match(url_pattern, self.unicode) and not match_in_a_list(exceptions, self.unicode):
-                    rules = rules_data['providers'][provider]['rules']
-                    r_deparamed = self.r_deparam(rules)
-                    if remove_referall_marketing:
-                        referall_marketing = rules_data['providers'][provider]['referralMarketing']
-                        return r_deparamed.deparam(referall_marketing)
-                    return r_deparamed
+    def remove_tracking(self, remove_referall_marketing=True, ruleset=None):
+        ''' Clean up the url by removing tracking parameters based on a CleanURLS collaborative list: https://gitlab.com/ClearURLs/rules/-/blob/master/data.min.json '''
+        if ruleset is None:
+            ruleset = load_rules()
+        observer = _stats
+        provider = ruleset.match(self.unicode, observer)
+        if provider is None:
+            return self
+        matches = provider.matcher(remove_referall_marketing).matches
+        if observer is None:
+            return self._filter_names(matches)
+        before = self._count_params()
+        self._filter_names(matches)
+        observer.stripped(provider, before - self._count_params())
         return self
 
     @property
@@ -398,8 +1353,196 @@ class URL(object):
     def pld(self):
         '''Return the 'pay-level domain' of the url
             (http://moz.com/blog/what-the-heck-should-we-call-domaincom)'''
+        if self._pld is None:
+            self._pld = _pld_of_host(self.host)
+        return self._pld
+
+    @property
+    def tld(self):
+        '''Return the top-level domain of a url'''
         if self.host:
-            return psl.get_public_suffix(self.host)
+            return '.'.join(self.pld.split('.')[1:])
+        return ''
+
+    @property
+    def absolute(self):
+        '''Return True if this is a fully-qualified URL with a hostname and
+        everything'''
+        return bool(self.host)
+
+    @property
+    def unicode(self):
+        '''Return a utf-8 version of this url'''
+        return str(self)
+
+
+class _SourceMixin(object):
+    '''The state of a url parsed lazily or from raw bytes, mixed into a
+    subclass of its URL class by _source_class. A lazily parsed url keeps its
+    string as _source until it is split, and a decoded one its encoding.'''
+
+    __slots__ = ()
+
+    # The components split_head gives a lazily parsed url
+    _HEAD = frozenset(['scheme', 'host', 'port', 'userinfo'])
+
+    _COMPONENTS = frozenset(COMPONENTS)
+
+    @classmethod
+    def _new(cls, source, encoding=None, components=None):
+        '''Return a lazily parsed url of the source string, or when source
+        is None, a url with these components'''
+        if components is not None:
+            self = cls._from_components(components)
+        else:
+            self = cls.__new__(cls)
+            for cache in cls._CACHES:
+                object.__setattr__(self, cache, None)
+        object.__setattr__(self, '_source', source)
+        object.__setattr__(self, 'encoding', encoding)
+        return self
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set, such as the
+        # components of a lazily parsed url. Special names are looked up by
+        # copy and pickle, and are no reason to parse it.
+        if name == '_source' or name[:2] == '__':
+            raise AttributeError(name)
+        source = self._source
+        if source is None:
+            raise AttributeError(
+                "'{}' object has no attribute '{}'".format(
+                    type(self).__name__, name))
+        if name in self._HEAD:
+            _setattr = object.__setattr__
+            (scheme, host, port, userinfo) = split_head(source)
+            _setattr(self, 'scheme', scheme)
+            _setattr(self, 'host', host)
+            _setattr(self, 'port', port)
+            _setattr(self, 'userinfo', userinfo)
+        else:
+            self._materialize()
+        return object.__getattribute__(self, name)
+
+    def _materialize(self):
+        '''Fully parse a lazily parsed url, with the __init__ of its URL
+        class'''
+        components = split_url(self._source)
+        object.__setattr__(self, '_source', None)
+        self._url_class.__init__(self, *components)
+
+    def __setattr__(self, name, value):
+        if name in self._COMPONENTS and self._source is not None:
+            # The other components of a lazily parsed url must not be
+            # parsed after this one changes
+            self._materialize()
+        super(_SourceMixin, self).__setattr__(name, value)
+
+    def __reduce__(self):
+        state = getattr(self, '__dict__', None) or None
+        if self._source is not None:
+            return (_source_url,
+                (self._url_class, self._source, self.encoding), state)
+        return (_source_url,
+            (self._url_class, None, self.encoding, self._components()), state)
+
+
+@lru_cache(maxsize=None)
+def _source_class(cls):
+    '''Return the subclass of the URL class cls for its urls parsed lazily
+    or from raw bytes. Only they have slots for that state.'''
+    return type(cls.__name__, (_SourceMixin, cls), {
+        '__slots__': ('_source', 'encoding'),
+        '__module__': cls.__module__,
+        '_url_class': cls,
+    })
+
+
+def _source_url(cls, source, encoding=None, components=None):
+    '''Return a url of the URL class cls parsed lazily or from raw bytes,
+    as _SourceMixin.__reduce__ saves it'''
+    return _source_class(cls)._new(source, encoding, components)
+
+
+class FrozenURL(object):
+    '''
+    An immutable and hashable URL, for use in sets and as dict keys. Get one
+    with URL.freeze() and a mutable URL back with thaw().
+
+    The hash is computed once. Equality compares the cached hashes and then
+    the components, without rendering the url.
+    '''
+
+    __slots__ = COMPONENTS + ('_hash', '_str')
+
+    def __init__(self, scheme, host, port, path, params, query, fragment, userinfo=None):
+        _setattr = object.__setattr__
+        _setattr(self, 'scheme', scheme)
+        _setattr(self, 'host', host)
+        _setattr(self, 'port', port)
+        _setattr(self, 'path', path)
+        _setattr(self, 'params', params)
+        _setattr(self, 'query', query)
+        _setattr(self, 'fragment', fragment)
+        _setattr(self, 'userinfo', userinfo)
+        _setattr(self, '_hash', hash(self.components))
+        _setattr(self, '_str', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('FrozenURL is immutable')
+
+    def __delattr__(self, name):
+        raise AttributeError('FrozenURL is immutable')
+
+    def __reduce__(self):
+        return (FrozenURL, self.components)
+
+    @property
+    def components(self):
+        '''Return a tuple of the components, in the constructor order'''
+        return (self.scheme, self.host, self.port, self.path, self.params,
+            self.query, self.fragment, self.userinfo)
+
+    def thaw(self):
+        '''Return a mutable URL with the same components'''
+        url = URL._from_components(self.components)
+        object.__setattr__(url, '_str', self._str)
+        return url
+
+    def __hash__(self):
+        return self._hash
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, FrozenURL):
+            return NotImplemented
+        return self._hash == other._hash and self.components == other.components
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        if result is NotImplemented:
+            return result
+        return not result
+
+    def __str__(self):
+        if self._str is None:
+            object.__setattr__(self, '_str', _unparse(*self.components))
+        return self._str
+
+    def __repr__(self):
+        return '<urlpy.FrozenURL object "{}">'.format(str(self))
+
+    @property
+    def hostname(self):
+        '''Return the hostname of the url.'''
+        return self.host or ''
+
+    @property
+    def pld(self):
+        '''Return the 'pay-level domain' of the url'''
+        if self.host:
+            return _public_suffix(self.host)
         return ''
 
     @property
@@ -419,3 +1562,863 @@ class URL(object):
     def unicode(self):
         '''Return a utf-8 version of this url'''
         return str(self)
+
+
+class URLSet(object):
+    '''
+    A set of urls deduplicated by equivalence (see URL.equiv): a url
+    equivalent to one already in the set is not added again. Membership is
+    a lookup of the URL.equiv_key() of a url. Iterating yields one url
+    string per equivalence class, the first one added.
+
+    With max_memory, once the estimated size in bytes of the urls held in
+    memory goes over it they are spilled to an on-disk store of SQLite files
+    partitioned by key hash, in directory or else a temporary directory that
+    is removed by close(). Memory then fills up again until the next spill.
+    The files of an earlier set in directory are overwritten by the first
+    spill. A closed set can no longer be used.
+    '''
+
+    def __init__(self, urls=(), max_memory=None, directory=None, partitions=16):
+        self.max_memory = max_memory
+        self.directory = directory
+        self.partitions = partitions
+        self._temporary = False
+        self._memory = {}
+        self._memory_size = 0
+        self._stores = None
+        self._length = 0
+        self._closed = False
+        for url in urls:
+            self.add(url)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __len__(self):
+        return self._length
+
+    def __contains__(self, url):
+        self._check_open()
+        key = URL.parse(url).equiv_key()
+        return key in self._memory or self._on_disk(key)
+
+    def __iter__(self):
+        self._check_open()
+        for url in self._memory.values():
+            yield url
+        if self._stores:
+            for store in self._stores:
+                for (url,) in store.execute('SELECT url FROM urls'):
+                    yield url
+
+    def add(self, url):
+        '''Add the url unless an equivalent one is in the set. Return True if
+        it was added.'''
+        self._check_open()
+        url = URL.parse(url)
+        key = url.equiv_key()
+        if key in self._memory or self._on_disk(key):
+            return False
+        url = str(url)
+        self._memory[key] = url
+        self._length += 1
+        if self.max_memory is not None:
+            self._memory_size += self._size(key, url)
+            if self._memory_size > self.max_memory:
+                self._spill()
+        return True
+
+    def discard(self, url):
+        '''Remove the url equivalent to url from the set, if any'''
+        self._check_open()
+        key = URL.parse(url).equiv_key()
+        if key in self._memory:
+            url = self._memory.pop(key)
+            if self.max_memory is not None:
+                self._memory_size -= self._size(key, url)
+            self._length -= 1
+        elif self._stores:
+            serialized = self._serialize(key)
+            store = self._store(serialized)
+            with store:
+                deleted = store.execute(
+                    'DELETE FROM urls WHERE key = ?', (serialized,)).rowcount
+            self._length -= deleted
+
+    def close(self):
+        '''Close the on-disk store and remove it if it is temporary'''
+        if self._stores:
+            for store in self._stores:
+                store.close()
+        self._stores = None
+        self._closed = True
+        if self._temporary:
+            import shutil
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._temporary = False
+            self.directory = None
+
+    def _check_open(self):
+        if self._closed:
+            raise ValueError('Operation on a closed URLSet')
+
+    @staticmethod
+    def _size(key, url):
+        '''Return an estimate of the memory used to hold a url'''
+        # The key tuple, its strings, the url string and the dict entry
+        return (sys.getsizeof(key) + sum(sys.getsizeof(k) for k in key)
+            + sys.getsizeof(url) + 100)
+
+    @staticmethod
+    def _serialize(key):
+        import json
+        return json.dumps(key, ensure_ascii=False)
+
+    def _partition(self, serialized):
+        '''Return the partition of the on-disk store for a serialized key'''
+        return zlib.crc32(
+            serialized.encode('utf-8', 'surrogatepass')) % self.partitions
+
+    def _store(self, serialized):
+        return self._stores[self._partition(serialized)]
+
+    def _on_disk(self, key):
+        if not self._stores:
+            return False
+        serialized = self._serialize(key)
+        found = self._store(serialized).execute(
+            'SELECT 1 FROM urls WHERE key = ?', (serialized,)).fetchone()
+        return found is not None
+
+    def _spill(self):
+        '''Move the urls held in memory to the on-disk store'''
+        if self._stores is None:
+            import sqlite3
+            if self.directory is None:
+                import tempfile
+                self.directory = tempfile.mkdtemp(prefix='urlpy2-')
+                self._temporary = True
+            self._stores = []
+            for partition in range(self.partitions):
+                location = os.path.join(
+                    self.directory, 'urlset-%d.sqlite' % partition)
+                store = sqlite3.connect(location)
+                store.execute('PRAGMA synchronous = OFF')
+                store.execute('PRAGMA journal_mode = OFF')
+                # Start afresh over the files of an earlier set
+                store.execute('DROP TABLE IF EXISTS urls')
+                store.execute('CREATE TABLE urls '
+                    '(key TEXT PRIMARY KEY, url TEXT NOT NULL)')
+                self._stores.append(store)
+
+        batches = [[] for _ in range(self.partitions)]
+        for key, url in self._memory.items():
+            serialized = self._serialize(key)
+            batches[self._partition(serialized)].append((serialized, url))
+        for store, batch in zip(self._stores, batches):
+            with store:
+                store.executemany(
+                    'INSERT OR IGNORE INTO urls VALUES (?, ?)', batch)
+        self._memory = {}
+        self._memory_size = 0
+
+
+_USES_RELATIVE = frozenset(urlparse.uses_relative)
+_USES_NETLOC = frozenset(urlparse.uses_netloc)
+
+
+class Resolver(object):
+    '''
+    Resolves relative references against one base url, as URL.relative
+    does, splitting the base only once. References without a network
+    location are resolved on the split base, with the dot segments removed
+    inline, straight into URL objects.
+    '''
+
+    def __init__(self, base):
+        self.base = str(base)
+        (self._scheme, self._netloc, self._path, self._params, self._query,
+            _) = urlparse.urlparse(self.base)
+        _, self._host, self._port, _, _, _, _, self._userinfo = split_url(
+            self.base)
+        # The base path without its last segment, unless it is a directory
+        self._parts = self._path.split('/')
+        if self._parts[-1] != '':
+            del self._parts[-1]
+        # References are resolved on the split base only when its netloc
+        # round trips through the url string
+        self._direct = bool(self._netloc) and self._scheme in _USES_NETLOC
+
+    def __repr__(self):
+        return '<urlpy.Resolver "{}">'.format(self.base)
+
+    def resolve(self, reference):
+        '''Return the URL of the reference string resolved against the
+        base'''
+        if not reference:
+            return URL.parse(self.base)
+        if not self._direct:
+            return URL.parse(urlparse.urljoin(self.base, reference))
+
+        cleaned = reference.lstrip(_C0_CONTROL_OR_SPACE)
+        for char in _UNSAFE_URL_CHARS:
+            if char in cleaned:
+                cleaned = cleaned.replace(char, '')
+        scheme, netloc, path, query, fragment = _SPLIT_RE.match(
+            cleaned).groups()
+        scheme = scheme.lower() if scheme else self._scheme
+        if scheme != self._scheme or scheme not in _USES_RELATIVE:
+            return URL.parse(reference)
+        if netloc:
+            return URL.parse(urlparse.urlunparse(
+                urlparse.urlparse(reference, self._scheme)))
+
+        params = ''
+        if scheme in _USES_PARAMS and ';' in path:
+            i = path.find(';', path.rfind('/') + 1)
+            if i >= 0:
+                path, params = path[:i], path[i + 1:]
+        query = query or ''
+
+        if not path and not params:
+            path = self._path
+            params = self._params
+            if not query:
+                query = self._query
+        else:
+            path = _resolve_path(self._parts, path)
+            if path[:1] != '/':
+                # As the url string would have it after the netloc
+                path = '/' + path
+
+        return URL(scheme, self._host, self._port, path, params, query,
+            fragment or '', self._userinfo)
+
+    def resolve_many(self, references):
+        '''Return the list of URLs of the reference strings resolved
+        against the base'''
+        resolve = self.resolve
+        return [resolve(reference) for reference in references]
+
+
+def _resolve_path(base_parts, path):
+    '''Return the path resolved against the segments of a base directory,
+    removing dot segments as urljoin does'''
+    if path[:1] == '/':
+        segments = path.split('/')
+    else:
+        segments = base_parts + path.split('/')
+        # Empty segments would make redundant slashes
+        segments[1:-1] = filter(None, segments[1:-1])
+
+    resolved = []
+    for segment in segments:
+        if segment == '..':
+            if resolved:
+                resolved.pop()
+        elif segment != '.':
+            resolved.append(segment)
+
+    if segments[-1] in ('.', '..'):
+        # The path refers to a directory
+        resolved.append('')
+    return '/'.join(resolved) or '/'
+
+
+def _method(name):
+    '''Return the URL method name, without the timing of the stats, which
+    Pipeline applies to its steps itself'''
+    method = getattr(URL, name)
+    return getattr(method, '__wrapped__', method)
+
+
+class Pipeline(object):
+    '''
+    A chain of URL operations resolved once and applied to many urls.
+
+    Operations are names of chainable URL methods such as 'defrag', or tuples
+    of a name and the method arguments such as ('deparam', ['utm_source']).
+    The parameter sets of deparam and r_deparam are compiled and the rules of
+    remove_tracking are loaded when the pipeline is built, not for each url.
+    While stats are enabled, each step is counted under the name of its
+    operation, or as normalize for fused operations.
+    '''
+
+    OPERATIONS = frozenset([
+        'abspath', 'canonical', 'defrag', 'deparam', 'deuserinfo', 'escape',
+        'punycode', 'r_deparam', 'remove_default_port', 'remove_tracking',
+        'sanitize', 'unescape', 'unpunycode'])
+
+    # The exceptions an operation may raise on a bad url
+    ERRORS = (ValueError, TypeError)
+
+    def __init__(self, operations=()):
+        self.operations = []
+        self.steps = []
+        # The operation name each step is counted as in the stats
+        self.names = []
+        self._timed = None
+        # Consecutive operations without arguments are fused into one
+        # URL.normalize call
+        fused = []
+        for operation in operations:
+            if isinstance(operation, (str, unicode)):
+                name, args = operation, ()
+            else:
+                name, args = operation[0], tuple(operation[1:])
+            if name not in self.OPERATIONS:
+                raise ValueError('Unknown URL operation: %r' % (name,))
+            self.operations.append((name,) + args)
+            if name in NORMALIZE_STEPS and not args:
+                fused.append(name)
+                continue
+            if fused:
+                self._add_normalize_step(fused)
+                fused = []
+            self.steps.append(self._step(name, args))
+            self.names.append(name)
+        if fused:
+            self._add_normalize_step(fused)
+
+    def __repr__(self):
+        return '<urlpy.Pipeline {}>'.format(self.operations)
+
+    def __reduce__(self):
+        # The steps are closures, built again from the operations
+        return (Pipeline, (self.operations,))
+
+    def _add_normalize_step(self, steps):
+        '''Add a step applying the normalization steps to an URL'''
+        steps = tuple(steps)
+        if len(steps) == 1:
+            self.steps.append(_method(steps[0]))
+            self.names.append(steps[0])
+            return
+        _normalize_plan(steps)
+        normalize = _method('normalize')
+        self.steps.append(lambda url: normalize(url, steps))
+        self.names.append('normalize')
+
+    @staticmethod
+    def _step(name, args):
+        '''Return a function applying the operation to an URL'''
+        if name == 'deparam':
+            matches = param_matcher(tuple(*args)).matches
+            return lambda url: url._filter_names(matches)
+        if name == 'r_deparam':
+            matches = param_matcher(tuple(*args), regex=True).matches
+            return lambda url: url._filter_names(matches)
+        if name == 'remove_tracking':
+            remove_referall_marketing = args[0] if args else True
+            ruleset = args[1] if len(args) > 1 else load_rules()
+            remove_tracking = _method('remove_tracking')
+            return lambda url: remove_tracking(
+                url, remove_referall_marketing, ruleset)
+        method = _method(name)
+        if args:
+            return lambda url: method(url, *args)
+        return method
+
+    def __call__(self, url):
+        '''Parse the url if needed and return it with all operations
+        applied'''
+        url = URL.parse(url)
+        for step in self._steps():
+            url = step(url)
+        return url
+
+    def _steps(self):
+        '''Return the steps, timed as their operations while stats are
+        enabled'''
+        stats = _stats
+        if stats is None:
+            return self.steps
+        if self._timed is None or self._timed[0] is not stats:
+            self._timed = (stats, [
+                stats.timed(name, step)
+                for name, step in zip(self.names, self.steps)])
+        return self._timed[1]
+
+    def map(self, urls, errors='strict'):
+        '''Return an iterator of the URLs for the urls with all operations
+        applied, in order. URL objects are modified in place.
+
+        On a url that cannot be processed, errors='strict' raises the error,
+        errors='skip' leaves the url out and errors='ignore' yields None.'''
+        if errors not in ('strict', 'skip', 'ignore'):
+            raise ValueError('Unknown errors handling: %r' % (errors,))
+        return self._map(urls, errors)
+
+    def _map(self, urls, errors):
+        parse = URL.parse
+        steps = self._steps()
+        for url in urls:
+            try:
+                url = parse(url)
+                for step in steps:
+                    url = step(url)
+            except self.ERRORS:
+                if errors == 'strict':
+                    raise
+                if errors == 'skip':
+                    continue
+                url = None
+            yield url
+
+
+def parse_many(urls, operations=(), errors='strict'):
+    '''Parse an iterable of url strings, or raw urls as URL.parse takes
+    them, and apply the operations, a Pipeline or a list of operations, to
+    each of them. Return an iterator of URL
+    objects in the order of urls. See Pipeline.map for errors.'''
+    if not isinstance(operations, Pipeline):
+        operations = Pipeline(operations)
+    return operations.map(urls, errors)
+
+
+def normalize_many(urls, operations=(), errors='strict'):
+    '''Same as parse_many, but return an iterator of url strings'''
+    results = parse_many(urls, operations, errors)
+    return (url if url is None else str(url) for url in results)
+
+
+# The bytes of a file extract_urls scans at once
+EXTRACT_WINDOW = 1 << 20
+
+# The longest url extract_urls finds, longer ones are cut there
+EXTRACT_MAX_LENGTH = 8192
+
+# A url in free text: a scheme we know followed by anything not a space,
+# quote or angle bracket. Trailing punctuation is taken off afterwards.
+_EXTRACT_RE = _LazyPattern(
+    br'(?i)\b(?:https?|ftps?)://[^\x00-\x20\x7f"\'<>`\\]{1,%d}'
+    % EXTRACT_MAX_LENGTH)
+
+_EXTRACT_TRAILING = b'.,;:!?)]}'
+
+
+def _extract_spans(location, window=EXTRACT_WINDOW):
+    '''Yield the raw bytes of each url in the file, in order. The file is
+    memory-mapped and scanned one window at a time, reading on past its end
+    only to finish the urls started in it.'''
+    import mmap
+
+    if window < 1:
+        raise ValueError('The window must be positive: %r' % (window,))
+    finditer = _EXTRACT_RE.finditer
+    with open(location, 'rb') as handle:
+        size = os.fstat(handle.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if hasattr(data, 'madvise'):
+                data.madvise(mmap.MADV_SEQUENTIAL)
+            pos = 0
+            while pos < size:
+                end = min(pos + window, size)
+                endpos = min(end + EXTRACT_MAX_LENGTH, size)
+                for match in finditer(data, pos, endpos):
+                    if match.start() >= end:
+                        break
+                    end = max(end, match.end())
+                    yield match.group().rstrip(_EXTRACT_TRAILING)
+                pos = end
+
+
+def extract_urls(location, operations=(), errors='skip',
+        window=EXTRACT_WINDOW):
+    '''Find the urls in a file of any text, such as logs or html, and apply
+    the operations to each of them like parse_many does. Return an iterator
+    of URL objects in the order of the file, which is memory-mapped and
+    scanned window bytes at a time. Urls are decoded as URL.parse does with
+    bytes, and by default those that cannot be processed are left out.'''
+    return parse_many(_extract_spans(location, window), operations, errors)
+
+
+def extract_normalized(location, operations=(), errors='skip',
+        window=EXTRACT_WINDOW):
+    '''Same as extract_urls, but return an iterator of url strings'''
+    results = extract_urls(location, operations, errors, window)
+    return (url if url is None else str(url) for url in results)
+
+
+# The number of lines read, processed and written at once by main
+CHUNK_SIZE = 1024
+
+
+def _normalize_lines(pipeline, lines, errors='keep'):
+    '''Return a list of the url strings for the raw url lines, see decode,
+    with the pipeline applied. Blank lines stay blank. On a url that cannot
+    be processed, errors='strict' raises, errors='skip' leaves it out and
+    errors='keep' returns it as read.'''
+    results = []
+    for line in lines:
+        text = decode(line)[0].strip()
+        if not text:
+            results.append(text)
+            continue
+        try:
+            results.append(str(pipeline(text)))
+        except Pipeline.ERRORS:
+            if errors == 'strict':
+                raise
+            if errors == 'keep':
+                results.append(text)
+    return results
+
+
+def _read_lines(files, stdin):
+    '''Yield the lines of each of the files in turn, reading stdin for -'''
+    for location in files:
+        if location == '-':
+            for line in stdin:
+                yield line
+            continue
+        with open(location, 'rb') as lines:
+            for line in lines:
+                yield line
+
+
+def _extract_lines(files, stdin):
+    '''Yield the raw bytes of each url found in the files in turn, scanning
+    stdin line by line for -'''
+    for location in files:
+        if location == '-':
+            for line in stdin:
+                for match in _EXTRACT_RE.finditer(line):
+                    yield match.group().rstrip(_EXTRACT_TRAILING)
+            continue
+        for span in _extract_spans(location):
+            yield span
+
+
+def _chunks(iterable, size):
+    '''Yield lists of up to size items of the iterable'''
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+# The Pipeline of a worker process of normalize_parallel
+_worker_pipeline = None
+
+
+def _init_worker(operations):
+    '''Build the pipeline of a worker process once, loading the rules and
+    the public suffix list it needs.'''
+    global _worker_pipeline
+    _worker_pipeline = Pipeline(operations)
+
+
+def _normalize_chunk(urls, errors):
+    '''Return a list of the normalized url strings of a chunk of urls'''
+    results = _worker_pipeline.map(urls, errors)
+    return [url if url is None else str(url) for url in results]
+
+
+def _normalize_lines_chunk(lines, errors):
+    '''Return a list of the normalized url strings of a chunk of lines'''
+    return _normalize_lines(_worker_pipeline, lines, errors)
+
+
+def _parallel_map(function, chunks, operations, errors, processes=None,
+        ordered=True, max_pending=None):
+    '''Yield the results of function(chunk, errors) for each of the chunks
+    computed by a pool of processes whose pipeline is built from operations.
+    At most max_pending chunks are in flight at once. Results are yielded in
+    the order of the chunks if ordered, else as soon as they are ready.'''
+    from collections import deque
+    from concurrent.futures import FIRST_COMPLETED
+    from concurrent.futures import ProcessPoolExecutor
+    from concurrent.futures import wait
+
+    processes = processes or os.cpu_count() or 1
+    max_pending = max_pending or 2 * processes
+    executor = ProcessPoolExecutor(
+        processes, initializer=_init_worker, initargs=(operations,))
+    pending = deque()
+
+    def ready():
+        '''Yield the results of the next chunk, or of every chunk done'''
+        if ordered:
+            yield pending.popleft().result()
+            return
+        done, _ = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            pending.remove(future)
+            yield future.result()
+
+    with executor:
+        for chunk in chunks:
+            while len(pending) >= max_pending:
+                for result in ready():
+                    yield result
+            pending.append(executor.submit(function, chunk, errors))
+        while pending:
+            for result in ready():
+                yield result
+
+
+def normalize_parallel(urls, operations=(), errors='strict', processes=None,
+        chunk_size=CHUNK_SIZE, ordered=True, max_pending=None):
+    '''Same as normalize_many, but spread the work over a pool of processes
+    (as many as there are CPUs by default). Each worker builds the pipeline,
+    and so loads the rules and public suffix list, once. Urls are sent to
+    workers in chunks of chunk_size, with at most max_pending chunks in
+    flight (twice the number of processes by default). If not ordered, the
+    results of a chunk come out as soon as they are ready.'''
+    if not isinstance(operations, Pipeline):
+        operations = Pipeline(operations)
+    if errors not in ('strict', 'skip', 'ignore'):
+        raise ValueError('Unknown errors handling: %r' % (errors,))
+    if chunk_size < 1:
+        raise ValueError('The chunk size must be positive: %r' % (chunk_size,))
+    results = _parallel_map(_normalize_chunk, _chunks(urls, chunk_size),
+        operations.operations, errors, processes, ordered, max_pending)
+    return (url for chunk in results for url in chunk)
+
+
+# The URL methods timed while stats are enabled
+STATS_OPERATIONS = (
+    'abspath', 'canonical', 'copy', 'defrag', 'deparam', 'deuserinfo',
+    'equiv', 'equiv_key', 'escape', 'filter_params', 'freeze', 'normalize',
+    'parse', 'punycode', 'r_deparam', 'relative', 'remove_default_port',
+    'remove_tracking', 'sanitize', 'unescape', 'unpunycode')
+
+# The Stats being collected, None while stats are disabled
+_stats = None
+
+
+class Stats(object):
+    '''
+    Calls and cumulative time of URL operations, and per provider counts of
+    matches, exception hits and stripped parameters in remove_tracking.
+
+    Times include the operations called by an operation, such as abspath
+    and escape within sanitize.
+    '''
+
+    def __init__(self):
+        self.calls = {}
+        self.seconds = {}
+        # Provider name to [matches, exception hits, stripped parameters]
+        self.providers = {}
+
+    def timed(self, name, method):
+        '''Return the method counting its calls and time as name'''
+        from time import perf_counter
+        calls, seconds = self.calls, self.seconds
+
+        @wraps(method)
+        def timed(*args, **kwargs):
+            start = perf_counter()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                calls[name] = calls.get(name, 0) + 1
+                seconds[name] = seconds.get(name, 0.0) + (
+                    perf_counter() - start)
+        return timed
+
+    def _provider(self, name):
+        counts = self.providers.get(name)
+        if counts is None:
+            counts = self.providers[name] = [0, 0, 0]
+        return counts
+
+    def exception(self, provider):
+        '''Count a url one of the provider's exceptions kept it from'''
+        self._provider(provider.name)[1] += 1
+
+    def stripped(self, provider, count):
+        '''Count a url the provider cleaned and the parameters it stripped'''
+        counts = self._provider(provider.name)
+        counts[0] += 1
+        counts[2] += count
+
+    def as_dict(self):
+        '''Return the stats as a dict of plain values'''
+        return {
+            'operations': dict(
+                (name, {'calls': calls, 'seconds': self.seconds[name]})
+                for name, calls in self.calls.items()),
+            'providers': dict(
+                (name, {
+                    'matches': counts[0],
+                    'exceptions': counts[1],
+                    'stripped': counts[2]})
+                for name, counts in self.providers.items()),
+        }
+
+
+def enable_stats():
+    '''Start collecting stats, from scratch. Until disable_stats, the URL
+    operations in STATS_OPERATIONS are replaced with timed versions.'''
+    global _stats
+    if _stats is not None:
+        disable_stats()
+    stats = Stats()
+    stats.originals = {}
+    for name in STATS_OPERATIONS:
+        method = stats.originals[name] = URL.__dict__[name]
+        if isinstance(method, classmethod):
+            timed = classmethod(stats.timed(name, method.__func__))
+        else:
+            timed = stats.timed(name, method)
+        setattr(URL, name, timed)
+    _stats = stats
+    return stats
+
+
+def disable_stats():
+    '''Stop collecting stats, restore the URL operations and return the
+    stats collected as a dict, or None if they were not enabled'''
+    global _stats
+    if _stats is None:
+        return None
+    for name, method in _stats.originals.items():
+        setattr(URL, name, method)
+    stats, _stats = _stats, None
+    return stats.as_dict()
+
+
+def get_stats():
+    '''Return the stats collected so far as a dict, or None if they are
+    not enabled'''
+    if _stats is None:
+        return None
+    return _stats.as_dict()
+
+
+def _label(value):
+    '''Return the value escaped for a Prometheus label'''
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def stats_prometheus(stats=None):
+    '''Return stats, by default those being collected, in the Prometheus
+    text exposition format'''
+    if stats is None:
+        stats = get_stats() or {'operations': {}, 'providers': {}}
+    metrics = [
+        ('urlpy2_operation_calls_total', 'Calls of URL operations.',
+            'operations', 'operation', 'calls'),
+        ('urlpy2_operation_seconds_total', 'Time spent in URL operations.',
+            'operations', 'operation', 'seconds'),
+        ('urlpy2_provider_matches_total',
+            'Urls cleaned by each ClearURLs provider.',
+            'providers', 'provider', 'matches'),
+        ('urlpy2_provider_exceptions_total',
+            'Urls a ClearURLs provider skipped because of an exception.',
+            'providers', 'provider', 'exceptions'),
+        ('urlpy2_provider_stripped_total',
+            'Parameters stripped by each ClearURLs provider.',
+            'providers', 'provider', 'stripped'),
+    ]
+    lines = []
+    for metric, text, section, label, key in metrics:
+        lines.append('# HELP {} {}'.format(metric, text))
+        lines.append('# TYPE {} counter'.format(metric))
+        for name, values in sorted(stats[section].items()):
+            lines.append('{}{{{}="{}"}} {!r}'.format(
+                metric, label, _label(name), values[key]))
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None, stdin=None, stdout=None):
+    '''Read newline-delimited urls from files or stdin, or with --extract
+    the urls found in them, and write them normalized to stdout, one per
+    line and in the same order. stdin and stdout are binary streams.'''
+    import argparse
+
+    def at_least(minimum):
+        def check(value):
+            value = int(value)
+            if value < minimum:
+                raise argparse.ArgumentTypeError(
+                    'must be at least %d: %d' % (minimum, value))
+            return value
+        return check
+
+    parser = argparse.ArgumentParser(
+        prog='python -m urlpy2',
+        description='Normalize newline-delimited urls.')
+    parser.add_argument('files', metavar='FILE', nargs='*', default=['-'],
+        help='a file of urls to read, or - for stdin (default)')
+    parser.add_argument('--errors', choices=('strict', 'skip', 'keep'),
+        default='keep',
+        help='what to do with a url that cannot be processed: stop, leave it '
+        'out, or write it unchanged (default)')
+    parser.add_argument('--extract', action='store_true',
+        help='find the urls in files of any text instead of reading one url '
+        'per line')
+    parser.add_argument('--chunk-size', type=at_least(1), default=CHUNK_SIZE,
+        help='the number of lines processed at once')
+    parser.add_argument('-j', '--jobs', type=at_least(0), default=1,
+        help='the number of worker processes, 0 for one per CPU (default: 1)')
+    parser.add_argument('--unordered', action='store_true',
+        help='with several jobs, write results as they are ready instead of '
+        'in input order')
+
+    operations = parser.add_argument_group(
+        'operations', 'URL operations, applied in the order given')
+    for name, help in [
+            ('defrag', 'remove the fragment'),
+            ('canonical', 'sort params and query arguments'),
+            ('abspath', "remove '.', '..' and duplicated slashes from the path"),
+            ('escape', 'percent-escape the path, params, query and userinfo'),
+            ('punycode', 'punycode the host'),
+            ('remove_tracking', 'remove tracking parameters (ClearURLs rules)'),
+            ('remove_default_port', 'remove the port if it is the default')]:
+        operations.add_argument('--' + name.replace('_', '-'),
+            dest='operations', action='append_const', const=name, help=help)
+    operations.add_argument('--deparam', dest='operations', action='append',
+        metavar='NAMES', type=lambda names: ('deparam', names.split(',')),
+        help='remove the comma-separated parameters')
+
+    args = parser.parse_args(argv)
+    pipeline = Pipeline(args.operations or ())
+    if stdin is None:
+        stdin = sys.stdin.buffer
+    if stdout is None:
+        stdout = sys.stdout.buffer
+
+    read = _extract_lines if args.extract else _read_lines
+    chunks = _chunks(read(args.files, stdin), args.chunk_size)
+    if args.jobs == 1:
+        outputs = (
+            _normalize_lines(pipeline, chunk, args.errors) for chunk in chunks)
+    else:
+        outputs = _parallel_map(_normalize_lines_chunk, chunks,
+            pipeline.operations, args.errors, args.jobs,
+            not args.unordered)
+
+    try:
+        for results in outputs:
+            if results:
+                stdout.write('\n'.join(results).encode('utf-8', 'replace'))
+                stdout.write(b'\n')
+        stdout.flush()
+    except Pipeline.ERRORS as e:
+        sys.stderr.write('error: {}\n'.format(e))
+        return 1
+    except BrokenPipeError:
+        # The reader went away, e.g. piped into head
+        sys.stderr.close()
+        return 1
+    except OSError as e:
+        # An input file that cannot be read
+        sys.stderr.write('error: {}\n'.format(e))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())